@@ -0,0 +1,134 @@
+import numpy as np
+import os
+
+from .HeaderHandler import HeaderHandler
+
+class CryptoDataIndex:
+    '''
+    Index over the crypto data column of an Inspector tracefile.
+
+    For every byte position the trace indices are kept sorted by byte value
+    (order), together with the start of every value bucket (offsets), so
+    traces whose crypto data byte at some position equals some value are
+    order[pos, offsets[pos, v]:offsets[pos, v+1]].
+    Every query returns a sorted array of trace indices, which can be used
+    directly to index an InspectorFileDataLoader.
+    '''
+    suffix = '.cidx.npz'
+
+    def __init__(self, order, offsets) -> None:
+        self.order = order
+        self.offsets = offsets
+
+    def __len__(self):
+        return self.order.shape[1]
+
+    @property
+    def crypto_length(self):
+        return self.order.shape[0]
+
+    @classmethod
+    def build(cls, crypto_data):
+        crypto_data = np.asarray(crypto_data, dtype=np.uint8)
+        if crypto_data.ndim != 2:
+            raise ValueError("Crypto data should be a 2-D array of (traces, bytes)")
+        ntraces, cryptolen = crypto_data.shape
+        dtype = np.uint32 if ntraces < 2**32 else np.uint64
+        order = np.empty(shape=(cryptolen, ntraces), dtype=dtype)
+        offsets = np.zeros(shape=(cryptolen, 257), dtype=np.int64)
+        # one position at a time keeps the full-size int64 argsort result to a single row;
+        # stable sorting keeps trace indices ascending inside every bucket
+        for pos in range(cryptolen):
+            column = np.ascontiguousarray(crypto_data[:, pos])
+            order[pos] = np.argsort(column, kind='stable')
+            np.cumsum(np.bincount(column, minlength=256), out=offsets[pos, 1:])
+        return cls(order, offsets)
+
+    @classmethod
+    def from_file(cls, fileinput:str, index_file=None, rebuild=False):
+        '''
+        Load the index persisted next to the tracefile, or build it from
+        the tracefile (and persist it) if missing, stale or rebuild is set.
+        '''
+        index_file = index_file or fileinput + cls.suffix
+        if not rebuild and os.path.exists(index_file) \
+                and os.path.getmtime(index_file) >= os.path.getmtime(fileinput):
+            return cls.load(index_file)
+        index = cls.build(cls.read_crypto_data(fileinput))
+        index.save(index_file)
+        return index
+
+    @staticmethod
+    def read_crypto_data(fileinput:str):
+        # reads only the crypto data column through a strided memory map
+        header_handler = HeaderHandler()
+        header_dict, offset = header_handler.parse_file(fileinput)
+        if not header_dict:
+            raise ValueError("Invalid header at {}.".format(offset))
+        header_handler.update(header_dict)
+        if not header_handler.crypto_length:
+            raise ValueError("No crypto data in {}".format(fileinput))
+        interval = header_handler.trace_interval
+        ntraces = (os.path.getsize(fileinput) - offset) // interval
+        traces = np.memmap(fileinput, dtype=np.uint8, mode='r', offset=offset,
+                           shape=(ntraces, interval))
+        crypto_data = np.array(traces[:, :header_handler.crypto_length])
+        del traces
+        return crypto_data
+
+    def save(self, filename):
+        with open(filename, 'wb') as fp:
+            np.savez(fp, order=self.order, offsets=self.offsets)
+
+    @classmethod
+    def load(cls, filename):
+        with np.load(filename) as data:
+            return cls(data['order'], data['offsets'])
+
+    def __check_position(self, position):
+        if position < 0:
+            position += self.crypto_length
+        if position >= self.crypto_length or position < 0:
+            raise IndexError("Crypto data position out of range")
+        return position
+
+    def equal(self, position:int, value:int):
+        position = self.__check_position(position)
+        if not 0 <= value < 256:
+            return np.zeros(0, dtype=np.int64)
+        start, stop = self.offsets[position, value], self.offsets[position, value + 1]
+        return self.order[position, start:stop].astype(np.int64)
+
+    def isin(self, position:int, values):
+        position = self.__check_position(position)
+        values = np.unique(np.asarray(values, dtype=np.int64))
+        values = values[(values >= 0) & (values < 256)]
+        buckets = [self.order[position, self.offsets[position, v]:self.offsets[position, v + 1]]
+                   for v in values]
+        if not buckets:
+            return np.zeros(0, dtype=np.int64)
+        return np.sort(np.concatenate(buckets).astype(np.int64))
+
+    def select(self, conditions:dict):
+        '''
+        conditions: {position: value or iterable of values}, all conditions
+        have to hold, e.g. select({0: 0x3a, 1: [0, 1]})
+        '''
+        matches = []
+        for position, value in conditions.items():
+            if isinstance(value, (int, np.integer)):
+                matches.append(self.equal(position, int(value)))
+            else:
+                matches.append(self.isin(position, value))
+        result = None
+        # start from the most selective condition to keep intersections small
+        for match in sorted(matches, key=len):
+            if result is None:
+                result = match
+            else:
+                result = np.intersect1d(result, match, assume_unique=True)
+            if not len(result):
+                break
+        if result is None:
+            return np.arange(len(self), dtype=np.int64)
+        return result
@@ -3,20 +3,21 @@ from .TraceHandler import HeaderHandler as inspector_header
 
 # This class can only process SINGLE Inspector file with header
 class InspectorFileDataLoader:    
-    def __init__(self, fileinput=None, with_header=False, parse_crypto_data=True, *args, **kwargs) -> None:
+    # chunk size in bytes of iter_chunks when neither chunk_traces nor max_memory is set
+    default_chunk_memory = 1024*1024*64
+
+    def __init__(self, fileinput=None, with_header=False, parse_crypto_data=True, *args, max_memory=None, **kwargs) -> None:
         self.header_handler = inspector_header()
         self.data_indicator = ''
         self.data_unpacker = None
+        # upper bound in bytes of a single read, None for unlimited
+        self.max_memory = max_memory
+        self.__scratch = None
         if with_header:
             self.header, self.start_offset = self.header_handler.parse_file(fileinput)
             self.header_handler.update(self.header)
             self.io = open(fileinput, 'rb')
-            ntraces = self.get_real_number_of_traces()
-            if ntraces != self.header_handler.number_of_traces:
-                print("Warning: Number of traces in header {} does not match actual number of traces {}".format(
-                    self.header_handler.number_of_traces, ntraces)
-                )
-                self.header_handler.set_header_manually(NT=ntraces)
+            self.header_handler.sync_number_of_traces(self.io.seek(0, 2), self.start_offset)
             if parse_crypto_data and self.header_handler.crypto_length:
                 self.support_data = np.zeros(shape=(
                     self.header_handler.number_of_traces, self.header_handler.crypto_length
@@ -56,11 +57,6 @@ class InspectorFileDataLoader:
     def __next_position(self):
         self.__forward(self.header_handler.trace_interval)
     
-    def __ith(self, i):
-        self.__zero_offset()
-        self.io.seek(i * self.header_handler.trace_interval, 1)
-        # self.cur = i
-
     def __read(self, nbytes=None):
         r = self.io.read(nbytes)
         if nbytes:
@@ -69,29 +65,11 @@ class InspectorFileDataLoader:
             self.__zero_offset()
         return r
 
-    def __forward_samples(self, nsamples=0):
-        return self.__forward(nsamples * self.header_handler.sample_length)
-    
-    def __rewind_samples(self, nsamples=0):
-        return self.__rewind(nsamples * self.header_handler.sample_length)
-
-    def __read_samples(self, nsamples=0):
-        return self.__read(nsamples * self.header_handler.sample_length)
-    
     def get_real_number_of_traces(self):
         total_bytes = self.io.seek(0, 2)
         self.__zero_offset()
-        cur_bytes = self.io.tell()
-        data_bytes = total_bytes - cur_bytes
-        if data_bytes % self.header_handler.trace_interval == 0:
-            return data_bytes // self.header_handler.trace_interval
-        else:
-            print("Warning: Trace file data is not aligned, discarding {} bytes".format(
-                data_bytes % self.header_handler.trace_interval
-            ))
-            return int(data_bytes / self.header_handler.trace_interval)
+        return self.header_handler.get_real_number_of_traces(total_bytes, self.start_offset)
 
-        
     def prepare(self, cryptolen=0):
         if not (self.support_data is None):
             self.__prepare_crypto_data()
@@ -131,8 +109,7 @@ class InspectorFileDataLoader:
             self.io.close()
         
     def __getitem__(self, index):
-        data = []
-        if not isinstance(index, (tuple, int, slice)):
+        if not isinstance(index, (tuple, int, np.integer, slice, list, np.ndarray)):
             raise IndexError("Unsupported Trace index {}".format(index))
 
         if isinstance(index, tuple):
@@ -140,85 +117,157 @@ class InspectorFileDataLoader:
         else:
             trace_index, sample_index = index, None
             
-        if isinstance(trace_index, int):
+        traces = self.__resolve_traces(trace_index)
+        nsamples = self.__count_samples(sample_index)
+        self.__check_memory(len(traces) * nsamples)
+
+        # allocated once and filled in place, no intermediate bytes per trace
+        data = np.empty(shape=(len(traces), nsamples), dtype=self.indicator)
+        self.read_into(data, traces, sample_index)
+        if len(traces) == 1:
+            return data[0]
+        return data
+
+    def read_into(self, out, traces=None, samples=None):
+        '''
+        Read traces directly into the caller provided ndarray `out`, which
+        has to be C-contiguous, of the sample dtype of the tracefile and hold
+        (number of traces, number of samples) elements. Contiguous samples are
+        read into `out` without intermediate buffers, other sample indices go
+        through a scratch buffer reused between calls. Returns `out`.
+        '''
+        traces = self.__resolve_traces(traces)
+        start, stop, picks = self.__resolve_samples(samples)
+        nsamples = stop - start if picks is None else len(picks)
+        if out.dtype != np.dtype(self.indicator):
+            raise TypeError("Output dtype {} does not match trace dtype {}".format(out.dtype, self.indicator))
+        if not out.flags.c_contiguous:
+            raise ValueError("Output array must be C-contiguous")
+        if out.size != len(traces) * nsamples:
+            raise ValueError("Output array of size {} can not hold {} traces of {} samples".format(
+                out.size, len(traces), nsamples))
+        view = out.reshape(len(traces), nsamples)
+        if not nsamples:
+            return out
+
+        target = None if picks is None else self.__get_scratch(stop - start)
+        base = self.start_offset + self.header_handler.crypto_length + start * self.header_handler.sample_length
+        for row, tracenum in enumerate(traces):
+            if tracenum >= self.header_handler.number_of_traces or tracenum < 0:
+                raise IndexError("Trace index out of range")
+            self.io.seek(base + tracenum * self.header_handler.trace_interval, 0)
+            if picks is None:
+                target = view[row]
+            nbytes = self.io.readinto(memoryview(target).cast('B'))
+            assert nbytes == target.nbytes
+            if picks is not None:
+                np.take(target, picks, out=view[row])
+        self.__zero_offset()
+        return out
+
+    def iter_chunks(self, traces=None, samples=None, chunk_traces=None):
+        '''
+        Iterate over the selected traces as (trace indices, data) chunks.
+        Chunks hold `chunk_traces` traces, or as many as fit in `max_memory`
+        (`default_chunk_memory` if unset).
+        The data buffer is allocated once and overwritten by every chunk, so
+        copy it if it has to outlive the iteration step.
+        '''
+        traces = self.__resolve_traces(traces)
+        nsamples = self.__count_samples(samples)
+        if not chunk_traces:
+            chunk_memory = self.max_memory or self.default_chunk_memory
+            chunk_traces = chunk_memory // max(1, nsamples * self.header_handler.sample_length)
+        chunk_traces = max(1, chunk_traces)
+        buffer = np.empty(shape=(min(chunk_traces, len(traces)), nsamples), dtype=self.indicator)
+        for start in range(0, len(traces), chunk_traces):
+            chunk = traces[start:start + chunk_traces]
+            data = buffer[:len(chunk)]
+            self.read_into(data, chunk, samples)
+            yield chunk, data
+
+    def __resolve_samples(self, sample_index):
+        # returns (start, stop, picks): samples [start, stop) are read, then
+        # picked by relative indices `picks` unless picks is None
+        samples_per_trace = self.header_handler.samples_per_trace
+        if sample_index is None:
+            return 0, samples_per_trace, None
+        elif isinstance(sample_index, (int, np.integer)):
+            sample_index = int(sample_index)
+            if sample_index < 0:
+                sample_index = samples_per_trace + sample_index
+            if sample_index >= samples_per_trace or sample_index < 0:
+                raise IndexError("Sample index out of range")
+            return sample_index, sample_index + 1, None
+        elif isinstance(sample_index, slice):
+            start, stop, step = sample_index.indices(samples_per_trace)
+            picks = np.arange(start, stop, step)
+            if step == 1 or len(picks) <= 1:
+                return start, start + len(picks), None
+        else:
+            picks = np.asarray(sample_index, dtype=np.int64)
+            picks = np.where(picks < 0, picks + samples_per_trace, picks)
+            if ((picks >= samples_per_trace) | (picks < 0)).any():
+                raise IndexError("Sample index out of range")
+            if not len(picks):
+                return 0, 0, None
+        low, high = picks.min(), picks.max()
+        return int(low), int(high) + 1, picks - low
+
+    def __get_scratch(self, nsamples):
+        if self.__scratch is None or len(self.__scratch) < nsamples:
+            self.__scratch = np.empty(shape=(nsamples,), dtype=self.indicator)
+        return self.__scratch[:nsamples]
+
+    def __resolve_traces(self, trace_index):
+        if isinstance(trace_index, (int, np.integer)):
+            trace_index = int(trace_index)
             if trace_index < 0:
                 trace_index = self.header_handler.number_of_traces + trace_index
             if trace_index >= self.header_handler.number_of_traces or trace_index < 0:
                 raise IndexError("Trace index out of range")
-            traces = [trace_index]
+            return [trace_index]
+        elif trace_index is None:
+            return range(self.header_handler.number_of_traces)
+        elif isinstance(trace_index, range) and (not trace_index or min(trace_index[0], trace_index[-1]) >= 0):
+            return trace_index
         elif isinstance(trace_index, slice):
-            start, stop, step = trace_index.indices(self.header_handler.number_of_traces)
-            traces = list(range(start, stop, step))
+            return range(*trace_index.indices(self.header_handler.number_of_traces))
+        elif isinstance(trace_index, np.ndarray) and trace_index.dtype == np.int64 and trace_index.ndim == 1 \
+                and (not len(trace_index) or trace_index.min() >= 0):
+            # already resolved, e.g. chunks of iter_chunks, so no copy is made per batch
+            return trace_index
         else:
             try:
-                traces = [i if i >= 0 else self.header_handler.number_of_traces + i 
-                    for i in index]
+                trace_index = np.asarray(trace_index)
             except:
-                raise IndexError("Unsupported Trace index {}".format(index))
-
-        for tracenum in traces:
-            self.__ith(tracenum)
-            data.append(self.__get_trace_data(sample_index))
-
-        return self.organize_trace_data(data)
-
-    def __get_trace_data(self, index=None)->bytes:
-        data = b''
-        if index is None:
-            data = self.__read(self.header_handler.single_trace_byte_length)
-        elif isinstance(index, int):
-            if index < 0:
-                index = self.header_handler.samples_per_trace + index
-            if index >= self.header_handler.samples_per_trace or index < 0:
-                pass
-            else:
-                self.__forward_samples(index)
-                data = self.__read_samples(1)
-        elif isinstance(index, slice):
-            # This eliminates outbound indices
-            start, stop, step = index.indices(self.header_handler.samples_per_trace)
-            self.__forward_samples(start)
-            if step == 1:
-                data = self.__read_samples(stop - start)
-            else:
-                while start < stop if step > 0 else start > stop:
-                    data += self.__read_samples(1)
-                    start += step
-                    self.__forward_samples(step) # when step < 0 it basically rewinds
-        else:
-            try:
-                samples = [i if i >= 0 else self.header_handler.samples_per_trace + i 
-                            for i in index]
-            except TypeError:
-                print("Uniterable indexing unapproved")
-            for each in samples:
-                if each >= self.header_handler.samples_per_trace or each < 0:
-                    raise IndexError("Index out of range")
-            if samples:
-                self.__forward_samples(samples[0])
-                data += self.__read_samples(1)
-                for i in range(1, len(samples)):
-                    self.__forward_samples(samples[i] - samples[i-1])
-                    data += self.__read_samples(1)
-            else:
-                data = b''
+                raise IndexError("Unsupported Trace index {}".format(trace_index))
+            if trace_index.ndim != 1:
+                raise IndexError("Trace index array must be one dimensional")
+            if trace_index.dtype == np.bool_:
+                # boolean mask over all traces, e.g. dataloader[dataloader.crypto_data[:, 0] == v]
+                if len(trace_index) != self.header_handler.number_of_traces:
+                    raise IndexError("Boolean index of length {} does not match {} traces".format(
+                        len(trace_index), self.header_handler.number_of_traces))
+                return np.flatnonzero(trace_index)
+            if len(trace_index) and not np.issubdtype(trace_index.dtype, np.integer):
+                raise IndexError("Unsupported Trace index dtype {}".format(trace_index.dtype))
+            # int64 keeps file offsets from overflowing with narrow index dtypes
+            trace_index = np.asarray(trace_index, dtype=np.int64)
+            return np.where(trace_index < 0, trace_index + self.header_handler.number_of_traces, trace_index)
 
-        return data
-    
-    def __frombytes(self, b:bytes):
-        assert len(b) % self.header_handler.sample_length == 0
-        l = len(b) // self.header_handler.sample_length
-        return np.ndarray(shape=(l,), dtype=self.indicator, buffer=b)
-
-    def organize_trace_data(self, data):
-        ext = []
-        if isinstance(data, list):
-            for d in data:
-                ext.append(self.__frombytes(d))
-        elif isinstance(data, bytes):
-            ext.append(self.__frombytes(data))
-        
-        if len(ext) == 1 and isinstance(ext, list):
-            ext = ext[0]
+    def __count_samples(self, sample_index):
+        if sample_index is None:
+            return self.header_handler.samples_per_trace
+        elif isinstance(sample_index, (int, np.integer)):
+            return 1
+        elif isinstance(sample_index, slice):
+            return len(range(*sample_index.indices(self.header_handler.samples_per_trace)))
+        else:
+            return len(sample_index)
 
-        return np.asarray(ext)
\ No newline at end of file
+    def __check_memory(self, nsamples):
+        nbytes = nsamples * self.header_handler.sample_length
+        if self.max_memory and nbytes > self.max_memory:
+            raise MemoryError("Reading {} bytes exceeds max_memory of {} bytes, "
+                "use read_into or iter_chunks instead".format(nbytes, self.max_memory))
@@ -130,10 +130,10 @@ class HeaderHandler:
             for tag in header:
                 if tag not in merged_header:
                     merged_header[tag] = header[tag]
-                elif merged_header[tag] == header[tag]:
-                    continue
                 elif tag == 0x41 : # accumulated number of traces
                     merged_header[tag] += header[tag]
+                elif merged_header[tag] == header[tag]:
+                    continue
                 elif not self.header_item[tag].consist:
                     merged_header[tag] = header[tag] # override
                 else:
@@ -209,6 +209,25 @@ class HeaderHandler:
     def increment_number_of_traces(self, incr):
         NT_tag = 0x41
         self.global_header_dict[NT_tag] += incr
+
+    # number of whole traces in a file of file_size bytes whose data starts at offset
+    def get_real_number_of_traces(self, file_size, offset):
+        data_bytes = file_size - offset
+        if data_bytes % self.trace_interval:
+            print("Warning: Trace file data is not aligned, discarding {} bytes".format(
+                data_bytes % self.trace_interval
+            ))
+        return data_bytes // self.trace_interval
+
+    # correct NT if it does not match the traces actually present in the file
+    def sync_number_of_traces(self, file_size, offset):
+        ntraces = self.get_real_number_of_traces(file_size, offset)
+        if ntraces != self.number_of_traces:
+            print("Warning: Number of traces in header {} does not match actual number of traces {}".format(
+                self.number_of_traces, ntraces)
+            )
+            self.set_header_manually(NT=ntraces)
+        return ntraces
     
     def summary(self, printout=False):
         header = self.__trim(self.global_header_dict)
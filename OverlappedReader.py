@@ -0,0 +1,154 @@
+import threading
+import time
+from collections import deque
+
+class OverlappedReader:
+    '''
+    Read several files concurrently ahead of a single consumer.
+
+    Iterating yields (file index, chunk) in file order and byte order, no
+    matter which reader thread finished first. Chunks are whole multiples of
+    `record_size` bytes. At most `max_buffer` bytes wait in the queues. Only
+    while nothing of the file the consumer currently drains is queued may its
+    reader go over budget, by a single chunk, so later files filling the
+    budget never deadlock the pipeline.
+
+    The number of concurrent reads follows the measured latency: enough reads
+    are kept in flight to cover one read latency at the rate the consumer
+    takes chunks (latency / consumer interval, plus one), between 1 and
+    `max_workers`. A slow share thus gets more parallel reads, while a slow
+    consumer gets fewer.
+    '''
+    def __init__(self, filelist, offsets, sizes, record_size, max_workers=4,
+                 max_buffer=1024*1024*256, chunksize=1024*1024*4) -> None:
+        '''
+        filelist: files to read, offsets: first byte to read in every file,
+        sizes: number of bytes to read from every file.
+        '''
+        self.filelist = list(filelist)
+        self.offsets = list(offsets)
+        self.sizes = list(sizes)
+        self.chunksize = max(1, chunksize // record_size) * record_size
+        self.max_workers = max(1, max_workers)
+        self.max_buffer = max_buffer
+
+        self.cond = threading.Condition()
+        self.queues = [deque() for _ in self.filelist]
+        self.done = [False] * len(self.filelist)
+        self.buffered = 0
+        self.next_file = 0
+        self.current = 0
+        self.in_flight = 0
+        self.active = min(2, self.max_workers)
+        self.error = None
+        self.stopped = False
+        self.threads = []
+
+        # moving averages in seconds, driving the number of concurrent reads
+        self.latency = 0.0  # per chunk read
+        self.interval = 0.0 # between chunks taken by the consumer
+        self.stalls = 0     # times the consumer had to wait for data
+
+    def __reader(self):
+        while True:
+            with self.cond:
+                if self.stopped or self.next_file >= len(self.filelist):
+                    return
+                i = self.next_file
+                self.next_file += 1
+            try:
+                self.__read_file(i)
+            except Exception as e:
+                with self.cond:
+                    self.error = e
+                    self.cond.notify_all()
+                return
+
+    def __read_file(self, i):
+        with open(self.filelist[i], 'rb') as IO:
+            IO.seek(self.offsets[i], 0)
+            remaining = self.sizes[i]
+            while remaining > 0:
+                size = min(self.chunksize, remaining)
+                with self.cond:
+                    while not self.stopped and (self.in_flight >= self.active or
+                            self.__over_budget(i, size)):
+                        self.cond.wait()
+                    if self.stopped:
+                        return
+                    self.in_flight += 1
+                begin = time.perf_counter()
+                try:
+                    data = IO.read(size)
+                finally:
+                    elapsed = time.perf_counter() - begin
+                    with self.cond:
+                        self.in_flight -= 1
+                        self.latency = self.__average(self.latency, elapsed)
+                        self.__adapt()
+                        self.cond.notify_all()
+                if len(data) != size:
+                    raise EOFError("Unexpected end of file {}".format(self.filelist[i]))
+                with self.cond:
+                    self.queues[i].append(data)
+                    self.buffered += size
+                    self.cond.notify_all()
+                remaining -= size
+        with self.cond:
+            self.done[i] = True
+            self.cond.notify_all()
+
+    def __over_budget(self, i, size):
+        if i == self.current and not self.queues[i]:
+            return False
+        return self.buffered + size > self.max_buffer
+
+    @staticmethod
+    def __average(average, sample):
+        return 0.8 * average + 0.2 * sample if average else sample
+
+    def __adapt(self):
+        if self.latency and self.interval:
+            target = int(self.latency / self.interval) + 1
+            self.active = max(1, min(self.max_workers, target))
+
+    def __iter__(self):
+        self.threads = [threading.Thread(target=self.__reader, daemon=True)
+                        for _ in range(self.max_workers)]
+        for thread in self.threads:
+            thread.start()
+        last = None
+        try:
+            for i in range(len(self.filelist)):
+                with self.cond:
+                    self.current = i
+                    self.cond.notify_all()
+                while True:
+                    with self.cond:
+                        if not self.queues[i] and not self.done[i] and not self.error:
+                            self.stalls += 1
+                            while not self.queues[i] and not self.done[i] and not self.error:
+                                self.cond.wait()
+                        if self.error:
+                            raise self.error
+                        if not self.queues[i]:
+                            break
+                        data = self.queues[i].popleft()
+                        self.buffered -= len(data)
+                        now = time.perf_counter()
+                        if last is not None:
+                            self.interval = self.__average(self.interval, now - last)
+                            self.__adapt()
+                        last = now
+                        self.cond.notify_all()
+                    yield i, data
+        finally:
+            self.close()
+
+    def close(self):
+        with self.cond:
+            self.stopped = True
+            self.cond.notify_all()
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
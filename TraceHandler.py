@@ -2,13 +2,17 @@ from tqdm import tqdm
 import os
 
 from .HeaderHandler import HeaderHandler
+from .OverlappedReader import OverlappedReader
+
+def identity(x):
+    return x
 
 class TraceHandler:
     def __init__(self, with_header=False, embed_crypto_data=False) -> None:
         self.header_handler = HeaderHandler()
         self.filelist = []
         self.buffer = b''
-        self.transformer = lambda x: x
+        self.transformer = identity
         self.with_header = with_header
         self.file_format = 'binary' # or 'npy', if 'npy', then with_header should be False
         self.embed_crypto = embed_crypto_data
@@ -26,15 +30,24 @@ class TraceHandler:
         else:
             raise ValueError("Invalid header at {}.".format(offset))
 
-    def __read_one_trace(self, IO):
+    # size of one trace in the input files
+    def __trace_size(self):
         crypto_len = self.header_handler['DS']
         sample_size = self.header_handler['SC'] & 0xf
         sample_number = self.header_handler['NS']
         if crypto_len and not self.embed_crypto:
-            size = crypto_len + sample_size * sample_number
+            return crypto_len + sample_size * sample_number
         else:
-            size = sample_size * sample_number
-        
+            return sample_size * sample_number
+
+    # where trace data starts in an input file, past its header if it has one
+    def __data_offset(self, file):
+        if self.with_header and self.file_info.get(file):
+            return self.file_info[file][1]
+        return 0
+
+    def __read_one_trace(self, IO):
+        size = self.__trace_size()
         buffer = IO.read(size)
         if buffer:
             assert len(buffer) == size
@@ -99,6 +112,7 @@ class TraceHandler:
         for i, file in enumerate(self.filelist):
             bar.set_description("Processing {}".format(os.path.split(file)[-1]))
             tracefile = open(file, 'rb')
+            tracefile.seek(self.__data_offset(file), 0)
             j = 0
             while True:
                 one_trace = self.__read_one_trace(tracefile)
@@ -107,20 +121,73 @@ class TraceHandler:
                 crypto_data = b''
                 if self.embed_crypto:
                     crypto_data = crypto_data_getter(trace_cnt, i, j)
-                    assert len(crypto_data_getter) == self.header_handler.crypto_length
+                    assert len(crypto_data) == self.header_handler.crypto_length
                 self.buffer += crypto_data + self.transformer(one_trace)
                 self.__write_buffer(out, chunksize)
                 trace_cnt += 1
+                j += 1
             tracefile.close()
         self.__write_buffer(out, chunksize, clear=True)
         bar.close()
         out.close()
 
+    def save2trs_overlapped(self, output:str, crypto_data_getter=None, chunksize=1024*1024*4,
+                            max_workers=4, max_buffer=1024*1024*256):
+        '''
+        Same as save2trs, but input files are read by up to `max_workers`
+        threads ahead of the writer, buffering at most `max_buffer` bytes.
+        Suits inputs on network shares where reading and writing would
+        otherwise stall each other. Output is identical to save2trs.
+        '''
+        if self.embed_crypto:
+            assert crypto_data_getter
+
+        if not self.header_handler:
+            self.generate_header()
+
+        size = self.__trace_size()
+        offsets, sizes = [], []
+        for file in self.filelist:
+            offset = self.__data_offset(file)
+            ntraces = (os.path.getsize(file) - offset) // size
+            offsets.append(offset)
+            sizes.append(ntraces * size)
+        reader = OverlappedReader(self.filelist, offsets, sizes, size, max_workers=max_workers,
+                                  max_buffer=max_buffer, chunksize=chunksize)
+
+        out = open(output, 'wb', buffering=chunksize)
+        out.write(self.header_handler.build())
+        trace_cnt = 0
+        last, j = -1, 0
+        bar = tqdm(total=self.header_handler['NT'], unit="traces")
+        try:
+            for i, chunk in reader:
+                if i != last:
+                    bar.set_description("Processing {}".format(os.path.split(self.filelist[i])[-1]))
+                    last, j = i, 0
+                ntraces = len(chunk) // size
+                if not self.embed_crypto and self.transformer is identity:
+                    out.write(chunk)
+                else:
+                    view = memoryview(chunk)
+                    for k in range(ntraces):
+                        crypto_data = b''
+                        if self.embed_crypto:
+                            crypto_data = crypto_data_getter(trace_cnt + k, i, j + k)
+                            assert len(crypto_data) == self.header_handler.crypto_length
+                        out.write(crypto_data + self.transformer(bytes(view[k*size:(k+1)*size])))
+                trace_cnt += ntraces
+                j += ntraces
+                bar.update(ntraces)
+        finally:
+            bar.close()
+            out.close()
+
     def generate_header(self):
         if self.with_header:
             for filename in self.filelist:
-                header, _ = self.file_info[filename][0]
-                self.header_handler.update(header)
+                header, _ = self.file_info[filename]
+                self.header_handler.update(dict(header))
             self.summary()
         else:
             for filename in self.filelist:
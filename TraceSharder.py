@@ -0,0 +1,103 @@
+from concurrent.futures import ThreadPoolExecutor
+from tqdm import tqdm
+import os
+
+from .HeaderHandler import HeaderHandler
+
+class TraceSharder:
+    '''
+    Split a single Inspector tracefile (with header) into N tracefiles with
+    balanced number of traces, the inverse of TraceHandler.save2trs.
+    Every shard gets its own header; trace bytes (crypto data included) are
+    copied concurrently with positional IO, so no shared file cursor is used.
+    '''
+    def __init__(self, fileinput:str) -> None:
+        self.fileinput = fileinput
+        self.header_handler = HeaderHandler()
+        header_dict, self.start_offset = self.header_handler.parse_file(fileinput)
+        if not header_dict:
+            raise ValueError("Invalid header at {}.".format(self.start_offset))
+        self.header_handler.update(header_dict)
+        self.header_handler.sync_number_of_traces(os.path.getsize(fileinput), self.start_offset)
+
+    def boundaries(self, nshards:int):
+        # [first trace, number of traces] of each shard, sizes differ by at most one
+        if nshards <= 0:
+            raise ValueError("Number of shards must be positive")
+        ntraces = self.header_handler.number_of_traces
+        base, extra = divmod(ntraces, nshards)
+        bounds, start = [], 0
+        for k in range(nshards):
+            count = base + (1 if k < extra else 0)
+            bounds.append([start, count])
+            start += count
+        return bounds
+
+    def build_shard_header(self, ntraces:int) -> bytes:
+        header = dict(self.header_handler.global_header_dict)
+        header[0x41] = ntraces
+        return self.header_handler.build(header)
+
+    def __copy_range(self, src_fd, dst_fd, src_offset, nbytes, chunksize, bar):
+        dst_offset = os.lseek(dst_fd, 0, os.SEEK_CUR)
+        while nbytes > 0:
+            size = min(chunksize, nbytes)
+            copied = 0
+            if hasattr(os, 'copy_file_range'):
+                try:
+                    copied = os.copy_file_range(src_fd, dst_fd, size, src_offset, dst_offset)
+                except OSError:
+                    copied = 0 # e.g. cross filesystem copy on older kernels, fall back
+            if not copied:
+                # both descriptors are private to this shard, so seeking is safe
+                # where positional IO is not available (Windows)
+                if hasattr(os, 'pread'):
+                    buffer = os.pread(src_fd, size, src_offset)
+                    copied = os.pwrite(dst_fd, buffer, dst_offset)
+                else:
+                    os.lseek(src_fd, src_offset, os.SEEK_SET)
+                    buffer = os.read(src_fd, size)
+                    os.lseek(dst_fd, dst_offset, os.SEEK_SET)
+                    copied = os.write(dst_fd, buffer)
+                if not buffer:
+                    raise EOFError("Unexpected end of file {}".format(self.fileinput))
+            src_offset += copied
+            dst_offset += copied
+            nbytes -= copied
+            bar.update(copied)
+
+    def __write_shard(self, output, start, count, chunksize, bar):
+        interval = self.header_handler.trace_interval
+        flags = os.O_RDONLY | getattr(os, 'O_BINARY', 0)
+        src_fd = os.open(self.fileinput, flags)
+        try:
+            with open(output, 'wb') as out:
+                out.write(self.build_shard_header(count))
+                out.flush()
+                self.__copy_range(src_fd, out.fileno(), self.start_offset + start * interval,
+                                  count * interval, chunksize, bar)
+        finally:
+            os.close(src_fd)
+        return output
+
+    def shard(self, outputs, max_workers=4, chunksize=1024*1024*64):
+        '''
+        outputs: list of shard filenames, or a format string with a single
+        replacement field like "shard_{:0>4}.trs" together with an integer
+        number of shards as outputs=(format, n).
+        Returns the list of [first trace, number of traces] of every shard.
+        '''
+        if isinstance(outputs, tuple) and len(outputs) == 2 and isinstance(outputs[1], int):
+            outputs = [outputs[0].format(k) for k in range(outputs[1])]
+        bounds = self.boundaries(len(outputs))
+        total = self.header_handler.number_of_traces * self.header_handler.trace_interval
+        bar = tqdm(total=total, unit="B", unit_scale=True)
+        try:
+            with ThreadPoolExecutor(max_workers=max_workers) as pool:
+                jobs = [pool.submit(self.__write_shard, output, start, count, chunksize, bar)
+                        for output, (start, count) in zip(outputs, bounds)]
+                for job in jobs:
+                    job.result()
+        finally:
+            bar.close()
+        return bounds
@@ -0,0 +1,153 @@
+from contextlib import ExitStack
+from tqdm import tqdm
+import numpy as np
+import os
+
+from .HeaderHandler import HeaderHandler
+
+class TraceSplitter:
+    '''
+    Shuffle traces of one or more Inspector tracefiles (with header) and split
+    them into several tracefiles, e.g. train/validation/test sets.
+
+    The shuffle is done at block level so that the IO stays mostly sequential:
+    traces are cut into contiguous blocks of `block_traces` traces, the order
+    of blocks is permuted, consecutive blocks are gathered into buckets of at
+    most `max_memory` bytes and traces are permuted again inside each bucket.
+    Identical inputs and seed always give identical outputs.
+    Crypto data is kept with its trace.
+    '''
+    # bytes of shuffled traces gathered per write, on top of the bucket
+    write_memory = 1024*1024*4
+
+    def __init__(self, seed=None, max_memory=1024*1024*256, block_traces=None) -> None:
+        self.header_handler = HeaderHandler()
+        self.filelist = []
+        self.file_info = {}
+        self.seed = seed
+        self.max_memory = max_memory
+        self.block_traces = block_traces
+
+    def append_file(self, filename):
+        header_dict, offset = self.header_handler.parse_file(filename)
+        if not header_dict:
+            raise ValueError("Invalid header at {} of file {}.".format(offset, filename))
+        parser = HeaderHandler()
+        parser.update(header_dict)
+        ntraces = parser.sync_number_of_traces(os.path.getsize(filename), offset)
+        self.header_handler.update(dict(header_dict))
+        self.filelist.append(filename)
+        self.file_info[filename] = [offset, ntraces]
+
+    def append_files(self, filenames:iter):
+        if isinstance(filenames, str):
+            self.append_file(filenames)
+        else:
+            for file in filenames:
+                self.append_file(file)
+
+    def __split_sizes(self, ratios):
+        total = self.header_handler.number_of_traces
+        if any(r < 0 for r in ratios) or sum(ratios) > 1 + 1e-9:
+            raise ValueError("Split ratios must be non-negative and sum up to at most 1")
+        sizes = [int(r * total) for r in ratios]
+        # hand the rounding leftovers to the last split if ratios cover everything
+        if abs(sum(ratios) - 1) < 1e-9:
+            sizes[-1] = total - sum(sizes[:-1])
+        return sizes
+
+    def __make_blocks(self, block_traces):
+        # (file index, first trace, number of traces), never crossing file boundaries
+        blocks = []
+        for i, file in enumerate(self.filelist):
+            _, ntraces = self.file_info[file]
+            for start in range(0, ntraces, block_traces):
+                blocks.append((i, start, min(block_traces, ntraces - start)))
+        return blocks
+
+    def __make_buckets(self, blocks, bucket_traces):
+        buckets, bucket, count = [], [], 0
+        for block in blocks:
+            if bucket and count + block[2] > bucket_traces:
+                buckets.append(bucket)
+                bucket, count = [], 0
+            bucket.append(block)
+            count += block[2]
+        if bucket:
+            buckets.append(bucket)
+        return buckets
+
+    def __read_bucket(self, bucket, ios):
+        interval = self.header_handler.trace_interval
+        ntraces = sum(block[2] for block in bucket)
+        data = np.empty(shape=(ntraces, interval), dtype=np.uint8)
+        row = 0
+        for i, start, count in bucket:
+            offset, _ = self.file_info[self.filelist[i]]
+            ios[i].seek(offset + start * interval, 0)
+            nbytes = ios[i].readinto(memoryview(data[row:row + count]).cast('B'))
+            assert nbytes == count * interval
+            row += count
+        return data
+
+    def split(self, outputs, ratios):
+        '''
+        outputs: filenames of split tracefiles
+        ratios: fraction of all traces written to each output, e.g.
+        [0.8, 0.1, 0.1]. Traces beyond the sum of ratios are dropped.
+        Returns the number of traces written to each output.
+        '''
+        if not outputs or len(outputs) != len(ratios):
+            raise ValueError("Number of outputs and ratios mismatch")
+        if not self.header_handler:
+            raise LookupError("No tracefile appended")
+
+        interval = self.header_handler.trace_interval
+        bucket_traces = max(1, self.max_memory // interval)
+        write_traces = max(1, self.write_memory // interval)
+        block_traces = self.block_traces or max(1, bucket_traces // 64)
+        if block_traces > bucket_traces:
+            raise ValueError("Block of {} traces exceeds memory budget of {} traces".format(
+                block_traces, bucket_traces
+            ))
+        sizes = self.__split_sizes(ratios)
+        bounds = np.cumsum(sizes)
+
+        rng = np.random.default_rng(self.seed)
+        blocks = self.__make_blocks(block_traces)
+        blocks = [blocks[k] for k in rng.permutation(len(blocks))]
+        buckets = self.__make_buckets(blocks, bucket_traces)
+
+        bar = tqdm(total=int(bounds[-1]), unit="traces")
+        position = 0
+        with ExitStack() as stack:
+            stack.callback(bar.close)
+            ios = [stack.enter_context(open(file, 'rb')) for file in self.filelist]
+            outs = []
+            for output, size in zip(outputs, sizes):
+                header = dict(self.header_handler.global_header_dict)
+                header[0x41] = size
+                out = stack.enter_context(open(output, 'wb'))
+                out.write(self.header_handler.build(header))
+                outs.append(out)
+
+            for bucket in buckets:
+                if position >= bounds[-1]:
+                    break
+                data = self.__read_bucket(bucket, ios)
+                permutation = rng.permutation(len(data))
+                # write consecutive runs of the shuffled order to their splits,
+                # gathering a few traces at a time instead of copying the bucket
+                cur = 0
+                while cur < len(data) and position < bounds[-1]:
+                    k = int(np.searchsorted(bounds, position, side='right'))
+                    take = min(len(data) - cur, int(bounds[k]) - position)
+                    for begin in range(cur, cur + take, write_traces):
+                        end = min(begin + write_traces, cur + take)
+                        outs[k].write(data[permutation[begin:end]])
+                    cur += take
+                    position += take
+                    bar.update(take)
+                # release the bucket before reading the next one
+                del data, permutation
+        return sizes
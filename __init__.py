@@ -1,3 +1,6 @@
 from .TraceHandler import TraceHandler
 from .HeaderHandler import HeaderHandler
-from .DataLoader import InspectorFileDataLoader
\ No newline at end of file
+from .DataLoader import InspectorFileDataLoader
+from .TraceSplitter import TraceSplitter
+from .TraceSharder import TraceSharder
+from .CryptoIndex import CryptoDataIndex